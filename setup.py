@@ -35,10 +35,13 @@ setup(
     package_dir={"": "src"},
     install_requires=[
         'tqdm',
+        'numpy',
         'pandas',
         'requests',
     ],
-    extra_requires={
-        'interactive': ['matplotlib']
+    extras_require={
+        'interactive': ['matplotlib'],
+        'fast': ['orjson'],
+        'parquet': ['pyarrow'],
     }
 )
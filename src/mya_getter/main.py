@@ -1,12 +1,18 @@
 import argparse
 import os
-import json
+import re
 from datetime import datetime, timedelta
 from typing import List
-from mya import do_parallel_queries
+from mya import do_parallel_queries, save_output
 from mya.mysampler import MySamplerQuery, mySampler
 from mya.mydata import MyDataQuery, myData
 
+# orjson is optional, but parses large configs much faster than the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 app_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 app_name = os.path.basename(app_root)
 
@@ -19,9 +25,10 @@ def process_input_file(filename: str):
     """
     queries = []
     valid_subs = ['mysampler', 'mydata']
-    with open(filename, mode="r") as f:
-        jsondata = ''.join(line for line in f if not line.strip().startswith('#'))
-        config = json.loads(jsondata)
+    with open(filename, mode="rb") as f:
+        # Blank out comment lines
+        jsondata = re.sub(rb'(?m)^[ \t]*#.*$', b'', f.read())
+        config = json_loads(jsondata)
         cmd = config['subcommand']
         if cmd not in valid_subs:
             raise RuntimeError(f"Unrecognized subcommand.  Valid subcommands = {valid_subs}")
@@ -75,7 +82,8 @@ def main():
 
     cfg = subparsers.add_parser('config', help='State what to query in a config file')
     cfg.add_argument('file', help="A config file defining the command, queries, and pv list", type=str)
-    cfg.add_argument('-o', '--output-file', help='File where output is saved', required=True, type=str)
+    cfg.add_argument('-o', '--output-file', required=True, type=str,
+                     help='File where output is saved, as Parquet if it ends in .parquet or .pq')
 
     mysampler_parser = subparsers.add_parser('mysampler', help='Run mySampler on a set of queries.')
     mysampler_parser.add_argument('-b', '--begin', help="The start time from which all queries are offset",
@@ -92,7 +100,8 @@ def main():
     mysampler_parser.add_argument('--num-queries',
                                   help='The number of queries to make, each space --query-interval from the last.',
                                   required=True, type=int)
-    mysampler_parser.add_argument('-o', '--output-file', help='File where output is saved', required=True, type=str)
+    mysampler_parser.add_argument('-o', '--output-file', required=True, type=str,
+                                  help='File where output is saved, as Parquet if it ends in .parquet or .pq')
     mysampler_parser.add_argument('-m', '--mya-deployment', help="MYA deployment to query (e.g. ops, history, etc.)",
                                   type=str, default=None)
     mysampler_ex = mysampler_parser.add_mutually_exclusive_group(required=True)
@@ -112,7 +121,8 @@ def main():
     mydata_parser.add_argument('--num-queries',
                                help='The number of queries to make, each space --query-interval from the last.',
                                required=True, type=int)
-    mydata_parser.add_argument('-o', '--output-file', help='File where output is saved', required=True, type=str)
+    mydata_parser.add_argument('-o', '--output-file', required=True, type=str,
+                               help='File where output is saved, as Parquet if it ends in .parquet or .pq')
     mydata_parser.add_argument('-s', '--single-pvs', help='Should myData make a single query per PV',
                                action='store_true', default=False)
     mydata_parser.add_argument('-m', '--mya-deployment', help="MYA deployment to query (e.g. ops, history, etc.)",
@@ -157,10 +167,10 @@ def main():
 
     if cmd == "mysampler":
         df = do_parallel_queries(mySampler, queries)
-        df.to_csv(f"{args.output_file}", index=False)
+        save_output(df, args.output_file)
     elif cmd == "mydata":
         df = do_parallel_queries(myData, queries)
-        df.to_csv(f"{args.output_file}", index=False)
+        save_output(df, args.output_file)
 
     exit(0)
 
@@ -1,3 +1,3 @@
 from .mydata import MyDataQuery, myData
 from .mysampler import MySamplerQuery, mySampler, mySamplerWeb
-from ._mya import Query, do_parallel_queries
+from ._mya import Query, do_parallel_queries, save_output
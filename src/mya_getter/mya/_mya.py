@@ -1,6 +1,11 @@
-from typing import List
+import io
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, List, TextIO
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import concurrent.futures
 
@@ -12,28 +17,101 @@ class Query:
         raise NotImplementedError("Query class is abstract")
 
 
-def do_parallel_queries(func: callable, queries: List[Query], max_workers: int = 8):
+@contextmanager
+def stream_command(args: List[str]) -> Iterator[io.TextIOWrapper]:
+    """Run a command and yield its stdout as a text stream that can be consumed while the command runs.
+
+    Stderr is spooled to a temporary file so that a chatty command cannot block on a full pipe.  The command is
+    started with close_fds=False so that CPython can launch it with posix_spawn instead of fork+exec when given an
+    absolute path, which avoids copying a large parent's page tables for every query.  Python's own descriptors are
+    non-inheritable, so the child still only gets its standard streams.
+
+    Args:
+        args: The command and its arguments
+
+    Raises:
+        CalledProcessError when the command exits with a non-zero status
+    """
+    with tempfile.TemporaryFile() as err:
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=err, bufsize=1 << 20,
+                              close_fds=False) as proc:
+            yield io.TextIOWrapper(proc.stdout, encoding='UTF-8')
+
+        if proc.returncode != 0:
+            err.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, args, stderr=err.read())
+
+
+def read_mya_table(stdout: TextIO, time_sep: str) -> pd.DataFrame:
+    """Read the whitespace aligned table printed by the MYA command line utilities into a DataFrame.
+
+    The header names a single date column, but each row splits its timestamp into date and time fields.  pandas
+    tokenizes the rows in one pass, then the two fields are joined back into a single string column.
+
+    Args:
+        stdout: The output of the MYA command, positioned at or before its header line
+        time_sep: The string placed between the date and time of each timestamp
+    """
+    # Skip any blank lines before the header.  No header at all means the command printed nothing.
+    header = []
+    for line in iter(stdout.readline, ''):
+        header = line.split()
+        if len(header) > 0:
+            break
+    if len(header) == 0:
+        return pd.DataFrame()
+
+    df = pd.read_csv(stdout, sep=r'\s+', engine='c', header=None, names=['_date', '_time'] + header[1:],
+                     dtype={'_date': str, '_time': str})
+    df.insert(0, header[0], df.pop('_date').str.cat(df.pop('_time'), sep=time_sep))
+
+    return df
+
+
+def do_parallel_queries(func: callable, queries: List[Query], max_workers: int = 8, use_processes: bool = False):
     """Call a mya utility wrapper in parallel for each query.  Returns a single DataFrame for all results.
 
+    Threads suit most queries since the workers mainly wait on a MYA command or server.  A process pool sidesteps the
+    GIL when parsing the results dominates, but func and the queries must then be picklable.
+
     Args:
         func: A function that wraps one of the MYA utilities, e.g., mySampler.
         queries: A list of queries to be used by func, e.g. MySamplerQuery for mySampler
-        max_workers: The maximum number of workers used in the process pool.
+        max_workers: The maximum number of workers used in the pool.
+        use_processes: Run the queries in a process pool instead of a thread pool.
     """
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    results = [None] * len(queries)
+    pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as executor:
 
-        # Submit a bunch of jobs to a pool.
-        futures = []
+        # Submit a bunch of jobs to a pool.  Remember which query each future belongs to since they finish out of order.
+        futures = {}
         for i in range(len(queries)):
-            futures.append(
-                executor.submit(func, queries[i]))
+            futures[executor.submit(func, queries[i])] = i
         #  Wait for results.  tqdm gives a progress bar
         for future in tqdm(concurrent.futures.as_completed(futures)):
-            results.append(future.result())
+            results[futures[future]] = future.result()
 
-        # Concat all of the individual DFs back into one big one.  Add a column that tracks which query a row is from
-        mya_df = pd.concat(results, keys=[f"query_{i}" for i in range(len(queries))])
-        mya_df = mya_df.reset_index().drop(columns=['level_1'])
+        # Concat all of the individual DFs back into one big one in query order.  Add a column that tracks which query a
+        # row is from.  The label repeats on every row of a query, so store it as a categorical.
+        mya_df = pd.concat(results, ignore_index=True)
+        labels = [f"query_{i}" for i in range(len(queries))]
+        codes = np.repeat(np.arange(len(results)), [len(df) for df in results])
+        mya_df.insert(0, 'level_0', pd.Categorical.from_codes(codes, categories=labels))
 
     return mya_df
+
+
+def save_output(df: pd.DataFrame, filename: str) -> None:
+    """Save query results as Parquet if the filename ends in .parquet or .pq, otherwise as CSV.
+
+    Parquet is much smaller and faster to write than CSV for large results, but requires pyarrow.
+
+    Args:
+        df: The query results
+        filename: The file to write
+    """
+    if filename.endswith(('.parquet', '.pq')):
+        df.to_parquet(filename, index=False, compression='zstd', engine='pyarrow')
+    else:
+        df.to_csv(filename, index=False)
@@ -1,9 +1,7 @@
 import pandas as pd
-import subprocess
-from io import StringIO
 from datetime import datetime
 from typing import List, Optional
-from ._mya import Query
+from ._mya import Query, read_mya_table, stream_command
 
 
 class MyDataQuery(Query):
@@ -58,21 +56,11 @@ def myData(query: MyDataQuery, mydata_cmd: str = '/usr/csite/certified/bin/myDat
         args = args + query.pv_list
     else:
         args = args + options + query.pv_list
-    output = subprocess.run(args=args, check=True, capture_output=True)
-    lines = output.stdout.decode('UTF-8').split('\n')
-
-    header = ';'.join(lines[0].strip().split())
-    out = [header]
-    for line in lines[1:]:
-        # Get date and time explicitly, the rest go into values
-        if len(line) == 0:
-            continue
-
-        date, time, *values = line.strip().split()
-        values = ';'.join(values)
-        out.append(f"{date}T{time};{values}")
-
-    df = pd.read_csv(StringIO('\n'.join(out)), sep=';')
+    with stream_command(args) as stdout:
+        df = read_mya_table(stdout, time_sep=' ')
+    if len(df.columns) == 0:
+        # myData printed nothing, so there is not even a header to parse
+        return df
     df.Date = pd.to_datetime(df.Date)
 
     return df
@@ -1,14 +1,20 @@
+import os
 import re
-import io
 from typing import List, Optional, Dict
 from datetime import datetime
 import logging
 
-import subprocess
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
-from ._mya import Query
+from ._mya import Query, read_mya_table, stream_command
+
+# orjson is optional, but parses large responses much faster than the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # Time-related constants
 MILLIS_PER_SECOND = 1_000
@@ -17,6 +23,36 @@ MILLIS_PER_HOUR = 3_600_000
 MILLIS_PER_DAY = 86_400_000
 MILLIS_PER_WEEK = 604_800_000
 
+# mySampler interval strings, e.g. '1s' or '15m'.  mySampler CLI does not support floats.
+_INTERVAL_RE = re.compile(r'^(\d+)(\D)$')
+_MILLIS_PER_UNIT = {
+    's': MILLIS_PER_SECOND,
+    'm': MILLIS_PER_MINUTE,
+    'h': MILLIS_PER_HOUR,
+    'd': MILLIS_PER_DAY,
+    'w': MILLIS_PER_WEEK,
+}
+
+# Share connections across web queries so parallel queries do not each pay for a new TCP/TLS handshake.  Size the pool
+# to cover do_parallel_queries' default workers.
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+    return session
+
+
+_session = _new_session()
+
+
+def _reset_session() -> None:
+    # Forked workers (do_parallel_queries with use_processes=True) must not share the parent's pooled TLS connections
+    global _session
+    _session = _new_session()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_session)
+
 
 class MySamplerQuery(Query):
     """A class for containing the arguments needed by mySampler."""
@@ -29,6 +65,13 @@ class MySamplerQuery(Query):
         self.pvlist = pvlist
         self.deployment = deployment
 
+        # The web API needs milliseconds between samples.  Parse it once here, but leave errors to to_web_params since
+        # the CLI may accept intervals we do not understand.
+        match = _INTERVAL_RE.match(self.interval)
+        self._millis = None
+        if match is not None and match.group(2) in _MILLIS_PER_UNIT:
+            self._millis = int(match.group(1)) * _MILLIS_PER_UNIT[match.group(2)]
+
     @staticmethod
     def from_config(start: str, interval: str, num_samples: str, pvlist: List[str], **kwargs):
         return MySamplerQuery(start=datetime.strptime(start, "%Y-%m-%d %H:%M:%S"),
@@ -44,40 +87,22 @@ class MySamplerQuery(Query):
         out['n'] = self.num_samples
         out['m'] = self.deployment
         
-        # Need milliseconds between samples.  Have to parse variety of strings.
-        time_pattern = '^(\d+)(\D)$'
-        if re.match(time_pattern, self.interval):
-            match = re.match(time_pattern, self.interval)
-            multiplier = int(match.group(1))  # mySample CLI does not support floats
-            unit = match.group(2)
-
-            if unit == 's':
-                millis = MILLIS_PER_SECOND
-            elif unit == 'm':
-                millis = MILLIS_PER_MINUTE
-            elif unit == 'h':
-                millis = MILLIS_PER_WEEK
-            elif unit == 'd':
-                millis = MILLIS_PER_DAY
-            elif unit == 'w':
-                millis = MILLIS_PER_WEEK
-            else:
-                raise ValueError(f"Unsupported time specification '{unit}")
-            out['s'] = int(millis) * multiplier
-        else:
-            raise ValueError(f"Unsupported time specification '{self.interval}")
+        if self._millis is None:
+            raise ValueError(f"Unsupported time specification '{self.interval}'")
+        out['s'] = self._millis
 
         return out      
 
 
 def mySamplerWeb(query: MySamplerQuery, mysampler_url: str = "https://epicsweb.jlab.org/myquery/mysampler",
-                 options: Optional[Dict[str,str]] = None) -> pd.DataFrame:
+                 options: Optional[Dict[str,str]] = None, session: Optional[requests.Session] = None) -> pd.DataFrame:
     """Run a web-based mysampler query.
 
     Args:
         query:  A query object that contains information needed by mySampler
         mysampler_url:  The base URL for the mysampler query
         options: A dictionary of key/value pairs to be passed as HTTP parameters
+        session: The session used to make the request.  Defaults to a module wide session that pools connections.
 
     Raises:
         RequestException when a problem making the query has occurred
@@ -92,35 +117,32 @@ def mySamplerWeb(query: MySamplerQuery, mysampler_url: str = "https://epicsweb.j
         for key in q_opts.keys():
             opts[key] = q_opts[key]
 
-    r = requests.get(mysampler_url, params=opts)
+    if session is None:
+        session = _session
+    r = session.get(mysampler_url, params=opts)
     
     if r.status_code != 200:
         raise requests.RequestException(f"Error contacting server. status={r.status_code}")
 
-    channels = r.json()['channels']
+    channels = json_loads(r.content)['channels']
     samples = {'Date': []}
     # If a channel has a disconnect event, then the mySampler CLI would have returned "<undefined>"
     # which would have made the entire series a str type.  Enforce that behavior for consistency, even though I
     # could query the metadata to figure out if <undefined> should be switched NaN and keep the numbers.
     types = {}
-    for idx, channel in enumerate(channels.keys()):
-        v = []
-        for sample in channels[channel]['data']:
-            # Grab only one datetime series
-            if idx == 1:
-                samples['Date'].append(sample['d'])
-
-            if 't' in sample.keys():
-                # The mySampler CLI simply returns <undefined>.  Better to match that than make users
-                # think about why there are incosistencies.
-                v.append("<undefined>")
-                types[channel] = 'str'
-            else:
-                v.append(sample['v'])
-        samples[channel] = v
-    
+    for idx, (channel, body) in enumerate(channels.items()):
+        data = body['data']
+        # Grab only one datetime series
+        if idx == 0:
+            samples['Date'] = [sample['d'].replace("T", "_") for sample in data]
+
+        # The mySampler CLI simply returns <undefined>.  Better to match that than make users
+        # think about why there are incosistencies.
+        samples[channel] = [sample['v'] if 't' not in sample else "<undefined>" for sample in data]
+        if any('t' in sample for sample in data):
+            types[channel] = 'str'
+
     df = pd.DataFrame(samples)
-    df.Date = df.Date.str.replace("T", "_")
     df = df.astype(types)
 
     return df
@@ -151,29 +173,10 @@ def mySampler(query: MySamplerQuery, mysampler_cmd: str = '/usr/csite/certified/
     args = args + query.pvlist
 
     logging.info(f"Starting {args[:7]} + {query.pvlist[0]}, ... ({len(query.pvlist)} PVs)")
-    output = subprocess.run(args=args, check=True, capture_output=True)
+    # mySampler returns a human readable table.  Parse it as it streams in from the command.
+    with stream_command(args) as stdout:
+        df = read_mya_table(stdout, time_sep='_')
     logging.info(f"Finished {args[:7]} + {query.pvlist[0]}, ... ({len(query.pvlist)} PVs)")
-    lines = output.stdout.decode('UTF-8').split('\n')
-    date_pattern = re.compile(r'^(\d\d\d\d-\d\d-\d\d) (\d.*)')
-    space_pattern = re.compile(r'(\s+)')
-
-    # mySampler returns a human readable format.  We want a CSV for pandas.
-    processed_lines = []
-    for line in lines:
-        # Remove trailing or leading whitespace
-        line = line.strip()
-
-        # Modify the timestamp format
-        line = re.sub(date_pattern, r"\1_\2", line)
-
-        # Convert multiple spaces to a single comma to be CSV compatible
-        line = re.sub(space_pattern, ',', line)
-
-        processed_lines.append(line)
-
-    # Create a single CSV string, then read it into a DataFrame
-    csv_out = "\n".join(processed_lines)
-    df = pd.read_csv(io.StringIO(csv_out))
 
     return df
 
@@ -1,12 +1,19 @@
 import warnings
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Union
 
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
 from .mya.mydata import myData, MyDataQuery
 from .mya.mysampler import MySamplerQuery, mySampler
-from .mya import do_parallel_queries
+from .mya import do_parallel_queries, save_output
+
+# North linac PVs sampled around trips: beam current, cavity gradients and neutron detector rates
+_NL_GMES_PVS = tuple(f"R1{z}{c}GMES" for z in "23456789ABCDEFGHIJKLMNOP" for c in '12345678')
+_NL_NDX_PVS = tuple(f"INX1L{z}_{r}DsRt" for z in ('05', '06', '07', '08', '22', '23', '24', '25', '26', '27')
+                    for r in 'gn')
+_NL_PVS = ('IBC0R08CRCUR1',) + _NL_GMES_PVS + _NL_NDX_PVS
 
 
 def collapse_overlapping_intervals(df: pd.DataFrame, start: str, end: str, aggs: Dict[str, str] = None) -> pd.DataFrame:
@@ -24,34 +31,58 @@ def collapse_overlapping_intervals(df: pd.DataFrame, start: str, end: str, aggs:
         aggs = {}
 
     tmp = df.sort_values(start)
-    tmp['interval_id'] = (tmp[start] > tmp[end].shift().cummax()).cumsum()
+    starts = tmp[start].to_numpy()
+    ends = tmp[end].to_numpy()
+
+    # A new interval begins when a start comes after every earlier end.  A row right after a missing end never starts
+    # one, matching the shift/cummax this replaced.  Otherwise fmax/fmin skip NaN/NaT like the pandas reductions.
+    new_interval = np.ones(len(tmp), dtype=bool)
+    new_interval[1:] = (starts[1:] > np.fmax.accumulate(ends[:-1])) & pd.notna(ends[:-1])
+    if aggs:
+        tmp['interval_id'] = np.cumsum(new_interval) - 1
+        return tmp.groupby(['interval_id']).agg({start: 'min', end: 'max', **aggs})
 
-    return tmp.groupby(['interval_id']).agg({start: 'min', end: 'max', **aggs})
+    # Rows are contiguous within an interval, so reduce over each run rather than paying for a groupby
+    bounds = np.flatnonzero(new_interval)
+    return pd.DataFrame({start: np.fmin.reduceat(starts, bounds), end: np.fmax.reduceat(ends, bounds)},
+                        index=pd.Index(np.arange(len(bounds)), name='interval_id'))
 
 
-def interval_overlap_any(int1: pd.Series, int2: pd.Series) -> List[bool]:
+def interval_overlap_any(int1: Union[pd.Series, pd.IntervalIndex],
+                         int2: Union[pd.Series, pd.IntervalIndex]) -> List[bool]:
     """Checks if each interval in first series overlaps with any interval in the seconds series.
 
-    Useful for seeing if an event occurred (flag was raise, etc.) during some other event.
+    Useful for seeing if an event occurred (flag was raise, etc.) during some other event.  Overlap follows the same
+    rules as pd.Interval.overlaps, so touching endpoints only overlap if both are closed.
 
     Args:
-        int1: A series of dtype pd.Interval
-        int2: A series of dtype pd.Interval
+        int1: An IntervalIndex, or a series of dtype pd.Interval
+        int2: An IntervalIndex, or a series of dtype pd.Interval
     """
-    overlaps = [False] * len(int1)
-    rf_overlaps = [False] * len(int2)
-    start_j = 0
-    for i in range(len(int1)):
-        for j in range(start_j, len(int2)):
-            if int1[i].overlaps(int2[j]):
-                overlaps[i] = True
-                rf_overlaps[j] = True
-                start_j = j
-                break
-            if int2[j].left > int1[i].right:
-                break
-
-    return overlaps
+    if len(int1) == 0 or len(int2) == 0:
+        return [False] * len(int1)
+
+    if not isinstance(int1, pd.IntervalIndex):
+        int1 = pd.IntervalIndex(int1)
+    if not isinstance(int2, pd.IntervalIndex):
+        int2 = pd.IntervalIndex(int2)
+    left1 = int1.left.to_numpy()
+    right1 = int1.right.to_numpy()
+
+    # Sort the second set by start, and track the latest end seen among all intervals starting up to that point
+    order = np.argsort(int2.left.to_numpy(), kind='stable')
+    left2 = int2.left.to_numpy()[order]
+    max_right2 = np.fmax.accumulate(int2.right.to_numpy()[order])
+
+    # Count the intervals in the second set that start before each interval in the first set ends.  One of them overlaps
+    # if the latest of their ends comes after the start of the first interval.
+    inclusive_end = int2.closed in ('left', 'both') and int1.closed in ('right', 'both')
+    inclusive_start = int1.closed in ('left', 'both') and int2.closed in ('right', 'both')
+    num_before = np.searchsorted(left2, right1, side='right' if inclusive_end else 'left')
+    latest_end = max_right2[np.maximum(num_before - 1, 0)]
+    ends_after = latest_end >= left1 if inclusive_start else latest_end > left1
+
+    return ((num_before > 0) & ends_after).tolist()
 
 
 def get_down_state_intervals(df, on_state=1, off_state=0) -> Tuple[List[datetime], List[datetime]]:
@@ -65,42 +96,36 @@ def get_down_state_intervals(df, on_state=1, off_state=0) -> Tuple[List[datetime
     Returns:
          A two-tuple with a lists of start times and end times.  Each start[i], end[i] is a single down state interval.
     """
-    starts = []
-    ends = []
-
-    s = None
-    e = None
-    for i in range(len(df)):
-        # If MYA lost track of the PV, just skip the fault we might be in.
-        if pd.isna(df.iloc[i, 1]):
-            s = None
-            e = None
-        # Only start intervals when a hall stops receiving beam
-        elif s is None and e is None:
-            if df.iloc[i, 1] == on_state:
-                pass
-            else:
-                s = df.Date[i]
-        elif df.iloc[i, 1] == off_state:
-            if s is None:
-                s = df.Date[i]
-                e = None
-            else:
-                warnings.warn(f"Found trip start with previous start still in memory.  Date: {df.iloc[i, 0]}, "
-                              f"{df.columns[1]}: {df.iloc[i, 1]}")
-                s = None
-                e = None
-        elif df.iloc[i, 1] == on_state:
-            if e is None:
-                e = df.Date[i]
-                starts.append(s)
-                ends.append(e)
-                s = None
-                e = None
-            else:
-                warnings.warn(f"Found trip end with previous end still in memory.  {df.iloc[i, :].to_string()}")
-                s = None
-                e = None
+    states = df.iloc[:, 1].to_numpy(dtype=np.float64, na_value=np.nan)
+    is_nan = np.isnan(states)
+    is_on = states == on_state
+    is_off = states == off_state
+    # Any other non-missing value starts a down state interval, but does not end one
+    is_other = ~(is_nan | is_on | is_off)
+
+    # Work out whether we are inside a down state interval before each row.  Missing values and on states always leave
+    # us outside of one, other values always leave us inside one.  An off state starts an interval when outside of one,
+    # but aborts the interval when already inside one, so a run of off states toggles.  That means the state before a
+    # row is set by the last row that was not off, flipped if an odd number of off rows have followed it.
+    pos = np.arange(len(states))
+    last_not_off = np.maximum.accumulate(np.where(is_off, -1, pos))
+    prev_not_off = np.roll(last_not_off, 1)
+    prev_not_off[:1] = -1
+    base = np.where(prev_not_off >= 0, is_other[prev_not_off], False)
+    in_interval = base ^ ((pos - 1 - prev_not_off) % 2 == 1)
+
+    # Intervals start on any non-missing, non-on value outside of an interval and end on the next on state
+    start_rows = np.flatnonzero(~in_interval & (is_off | is_other))
+    end_rows = np.flatnonzero(in_interval & is_on & ~is_off)
+
+    warn_rows = np.flatnonzero(in_interval & is_off)
+    for date, value in zip(df.iloc[warn_rows, 0], df.iloc[warn_rows, 1]):
+        warnings.warn(f"Found trip start with previous start still in memory.  Date: {date}, {df.columns[1]}: {value}")
+
+    # Each end closes the interval opened by the most recent start before it
+    start_rows = start_rows[np.searchsorted(start_rows, end_rows) - 1]
+    starts = df.Date.iloc[start_rows].tolist()
+    ends = df.Date.iloc[end_rows].tolist()
 
     return starts, ends
 
@@ -115,35 +140,26 @@ def remove_repeat_values(df, values_col):
     Note: This changes the order of rows to be sorted by the 'Date' column
     """
 
-    # Sort these rows chronologically.  Some values have the same date/time so make sure to keep the index order in case
-    # of a tie.
-    df.rename_axis('idx').sort_values(by=['Date', 'idx'], inplace=True)
-
-    # Iterate through identifying rows that match previous row values to drop
-    rows_to_drop = []
-    prev = None
-    for i in range(len(df)):
-        curr = df[values_col][i]
-        if prev is None:
-            prev = curr
-            continue
+    # Sort these rows chronologically.  Some values have the same date/time so use a stable sort to keep the existing
+    # row order in case of a tie.
+    df = df.sort_values(by='Date', kind='stable')
 
-        if prev == curr:
-            rows_to_drop.append(i)
-
-        prev = curr
-
-    # Drop the rows and return
-    return df.drop(rows_to_drop).reset_index(drop=True)
+    # Keep only the rows whose value differs from the previous row.  NaN never matches, so those rows are kept.
+    values = df[values_col]
+    return df[values.ne(values.shift())].reset_index(drop=True)
 
 
 def get_combined_down_state_intervals(pvs: List[str], begin: datetime, end: datetime, on_state: int = 1,
                                       off_state: int = 0, max_duration: Optional[float] = None) -> pd.DataFrame:
     """Generates a DataFrame of time intervals that represent the contiguous periods off time where a PV was 'down'.
 
-    Each PV is queried to generate the down state time intervals individually.  Only individual PV intervals of duration
-    less that 'max_duration' are kept.  Then overlapping intervals across PVs are combined to produce a single row
-    with the earliest start time and latest end time for those overlapping down state intervals.
+    All PVs are queried at once, then each PV's down state time intervals are generated individually.  Only individual
+    PV intervals of duration less that 'max_duration' are kept.  Then overlapping intervals across PVs are combined to
+    produce a single row with the earliest start time and latest end time for those overlapping down state intervals.
+
+    Note: Repeated values are dropped from each PV before its intervals are found, since the multi-PV query reports a
+    row whenever any PV changes.  A PV that archives two off states in a row therefore keeps its interval instead of
+    aborting it like get_down_state_intervals does.
 
     Args:
         pvs: A list of PV names
@@ -156,17 +172,25 @@ def get_combined_down_state_intervals(pvs: List[str], begin: datetime, end: date
     Returns:
         A DataFrame of rows with start, end, and duration columns.  One row per down time interval
     """
-    pv_trips = []
+    # Make a single query for all of the PVs.  myData reports a row whenever any of the PVs changes, so drop the rows
+    # where a PV just repeats its previous value before looking at its state changes.
+    mya_df = myData(MyDataQuery(begin=begin, end=end, pvlist=list(pvs)))
+
+    trip_pvs = []
+    trip_starts = []
+    trip_ends = []
     for pv in pvs:
-        tmp_df = myData(MyDataQuery(begin=begin, end=end, pvlist=[pv]))
-        tmp_df.iloc[:, 1] = pd.to_numeric(tmp_df.iloc[:, 1], errors='coerce')
+        values = pd.to_numeric(mya_df[pv], errors='coerce')
+        tmp_df = pd.DataFrame({'Date': mya_df['Date'], pv: values})
+        tmp_df = remove_repeat_values(tmp_df, values_col=pv)
         starts, ends = get_down_state_intervals(tmp_df, on_state=on_state, off_state=off_state)
-        tmp_df = pd.DataFrame({'pv': [pv] * len(starts), 'start': starts, 'end': ends})
-        pv_trips.append(tmp_df)
+        trip_pvs.extend([pv] * len(starts))
+        trip_starts.extend(starts)
+        trip_ends.extend(ends)
 
     # Get one DataFrame of beam stoppages, then keep only trips (those <= 5 minutes)
-    df = pd.concat(pv_trips).reset_index(drop=True)
-    df['duration'] = df.apply(lambda x: (x.end - x.start).total_seconds(), axis=1)
+    df = pd.DataFrame({'pv': trip_pvs, 'start': pd.to_datetime(trip_starts), 'end': pd.to_datetime(trip_ends)})
+    df['duration'] = (df['end'] - df['start']).dt.total_seconds()
     if max_duration is not None:
         df = df[df.duration <= max_duration]
 
@@ -199,34 +223,39 @@ def get_rf_trip_intervals(begin: datetime, end: datetime):
 
     # Find the start and end times of beam trips
     beam_present_df = myData(MyDataQuery(begin=begin, end=end, pvlist=[beam_present_pv]))
-    beam_present_df.iloc[:, 1] = pd.to_numeric(beam_present_df.iloc[:, 1], errors='coerce')
+    # These PVs hold small integer states, so float32 stores them exactly.  pandas downcasts whenever float32 is within
+    # ~1e-8 of the value, so this would round a PV with fractional values.
+    beam_present_df[beam_present_pv] = pd.to_numeric(beam_present_df[beam_present_pv], errors='coerce',
+                                                      downcast='float')
     beam_present_df = beam_present_df[ (beam_present_df.Date > overlap_end) | (beam_present_df.Date < overlap_start)]
     beam_present_df = beam_present_df.reset_index(drop=True)
 
     beam_starts, beam_ends = get_down_state_intervals(beam_present_df, on_state=0, off_state=2)
-    beam_trip_df = pd.DataFrame({'pv': [beam_present_pv] * len(beam_starts), 'start': beam_starts, 'end': beam_ends})
+    beam_trip_df = pd.DataFrame({'pv': [beam_present_pv] * len(beam_starts), 'start': pd.to_datetime(beam_starts),
+                                 'end': pd.to_datetime(beam_ends)})
     # Exclude scenarios where the beam stayed off for more than an 5 minutes.  Those aren't "trips"
-    beam_trip_df = beam_trip_df[beam_trip_df.apply(lambda x: (x.end - x.start).total_seconds(), axis=1) < 300]
+    beam_trip_df = beam_trip_df[(beam_trip_df['end'] - beam_trip_df['start']).dt.total_seconds() < 300]
     beam_trip_df = beam_trip_df.reset_index(drop=True)
 
     # This is a count of the number of RF trips in recent history.  I'm a little hazy on the details.
     # We just want to know if an RF trip happened somewhere in CEBAF that caused beam to trip off.
     rf_trip_df = myData(MyDataQuery(begin=begin, end=end, pvlist=[rf_trip_pv]))
-    rf_trip_df.iloc[:, 1] = pd.to_numeric(rf_trip_df.iloc[:, 1], errors='coerce')
+    rf_trip_df[rf_trip_pv] = pd.to_numeric(rf_trip_df[rf_trip_pv], errors='coerce', downcast='float')
     rf_trip_df.loc[rf_trip_df[rf_trip_pv] > 0, rf_trip_pv] = 1
     rf_trip_df = rf_trip_df[(rf_trip_df.Date > overlap_end) | (rf_trip_df.Date < overlap_start)].reset_index(drop=True)
 
     rf_trip_df = remove_repeat_values(rf_trip_df, values_col=rf_trip_pv)
     starts, ends = get_down_state_intervals(rf_trip_df, on_state=0, off_state=1)
-    rf_trip_df = pd.DataFrame({'pv': [rf_trip_pv] * len(starts), 'start': starts, 'end': ends})
+    rf_trip_df = pd.DataFrame({'pv': [rf_trip_pv] * len(starts), 'start': pd.to_datetime(starts),
+                               'end': pd.to_datetime(ends)})
 
     # This tells us which trips as seen by the halls were caused by RF
-    beam_trip_intervals = beam_trip_df.apply(lambda x: pd.Interval(x.start, x.end, closed='left'), axis=1)
-    # hall_intervals = hall_trip_df.apply(lambda x: pd.Interval(x.start, x.end, closed='left'), axis=1)
-    rf_intervals = rf_trip_df.apply(lambda x: pd.Interval(x.start, x.end, closed='left'), axis=1)
+    beam_trip_intervals = pd.IntervalIndex.from_arrays(beam_trip_df['start'], beam_trip_df['end'], closed='left')
+    # hall_intervals = pd.IntervalIndex.from_arrays(hall_trip_df['start'], hall_trip_df['end'], closed='left')
+    rf_intervals = pd.IntervalIndex.from_arrays(rf_trip_df['start'], rf_trip_df['end'], closed='left')
     rf_caused = interval_overlap_any(beam_trip_intervals, rf_intervals)
 
-    return beam_trip_df[rf_caused].reset_index(drop=True)
+    return beam_trip_df[np.array(rf_caused, dtype=bool)].reset_index(drop=True)
 
 
 def get_mya_samples_from_trips(trip_df: pd.DataFrame, data_file: str = None, max_workers: Optional[int] = None):
@@ -234,22 +263,21 @@ def get_mya_samples_from_trips(trip_df: pd.DataFrame, data_file: str = None, max
 
     This is currently left in the application code as an example of how the functionality of the of trips package could
     be used.
+
+    Args:
+        trip_df: A DataFrame of trips with start and end columns
+        data_file: Optional file to save the samples to.  Saved as Parquet if it ends in .parquet or .pq, otherwise as
+                   CSV.  Parquet is much smaller and faster to write for the large exports this typically produces.
+        max_workers: The maximum number of mySampler queries to run at once
     """
 
     # Limit PVs to only the North linac this time.
-    pvs = ['IBC0R08CRCUR1']
-    for z in "23456789ABCDEFGHIJKLMNOP":
-        for c in '12345678':
-            pvs.append(f"R1{z}{c}GMES")
-    for z in ['05', '06', '07', '08', '22', '23', '24', '25', '26', '27']:
-        for r in 'gn':
-            pvs.append(f"INX1L{z}_{r}DsRt")
-
-    queries = []
-    for i in range(len(trip_df)):
-        # We want one sample per second
-        num_samples = int((trip_df.end[i] - trip_df.start[i]).total_seconds() + 1)
-        queries.append(MySamplerQuery(start=trip_df.start[i], interval='1s', num_samples=num_samples, pvlist=pvs))
+    pvs = list(_NL_PVS)
+
+    # We want one sample per second
+    num_samples = ((trip_df['end'] - trip_df['start']).dt.total_seconds() + 1).astype(np.int64).tolist()
+    queries = [MySamplerQuery(start=start, interval='1s', num_samples=n, pvlist=pvs)
+               for start, n in zip(trip_df['start'].tolist(), num_samples)]
 
     if max_workers is not None:
         data_df = do_parallel_queries(func=mySampler, queries=queries, max_workers=max_workers)
@@ -257,7 +285,7 @@ def get_mya_samples_from_trips(trip_df: pd.DataFrame, data_file: str = None, max
         data_df = do_parallel_queries(func=mySampler, queries=queries)
 
     if data_file is not None:
-        data_df.to_csv(data_file)
+        save_output(data_df, data_file)
 
     return data_df
 
@@ -270,7 +298,9 @@ def get_trip_subsets(trip_df: pd.DataFrame, rf_zones: List[str] = ('R1M', 'R1N',
     gmes_cols = [f"{z}{c}GMES" for z in rf_zones for c in range(1, 9)]
     ndx_cols = [f"INX{z}_{r}DsRt" for z in ndx_zones for r in 'gn']
 
-    has_trip = trip_df.groupby([trip_col])[gmes_cols].apply(lambda x: x.max() - x.min() > trip_threshold).any(axis=1)
-    subset_df = trip_df.copy().set_index(trip_col, drop=False).loc[has_trip, :].reset_index(drop=True)
+    # A trip shows up as a large peak-to-peak swing in any cavity's gradient
+    gmes = trip_df.groupby(trip_col, observed=True)[gmes_cols]
+    has_trip = ((gmes.max() - gmes.min()) > trip_threshold).any(axis=1)
+    subset_df = trip_df[trip_df[trip_col].isin(has_trip.index[has_trip])].reset_index(drop=True)
 
     return subset_df
@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from mya_getter.mya import do_parallel_queries, save_output
+
+
+def fake_query(query):
+    # Earlier queries sleep longer so that they finish last
+    time.sleep(0.05 * (3 - query))
+    return pd.DataFrame({'Date': [f"2023-05-01 00:00:0{query}"] * (query + 1), 'value': [query] * (query + 1)})
+
+
+class TestMya(unittest.TestCase):
+
+    def test_do_parallel_queries_order(self):
+        result = do_parallel_queries(func=fake_query, queries=[0, 1, 2, 3], max_workers=4)
+
+        self.assertIsInstance(result['level_0'].dtype, pd.CategoricalDtype)
+        self.assertListEqual(['query_0', 'query_1', 'query_2', 'query_3'], list(result['level_0'].cat.categories))
+        self.assertListEqual([f"query_{q}" for q in result['value']], result['level_0'].astype(str).tolist())
+        self.assertListEqual([0, 1, 1, 2, 2, 2, 3, 3, 3, 3], result['value'].tolist())
+
+    def test_save_output_csv(self):
+        df = do_parallel_queries(func=fake_query, queries=[0, 1], max_workers=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            save_output(df, os.path.join(tmp, 'out.csv'))
+            self.assertListEqual(list(df.columns), list(pd.read_csv(os.path.join(tmp, 'out.csv')).columns))
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "requires the optional pyarrow dependency")
+    def test_save_output_parquet(self):
+        df = do_parallel_queries(func=fake_query, queries=[0, 1], max_workers=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('out.parquet', 'out.pq'):
+                save_output(df, os.path.join(tmp, name))
+                assert_frame_equal(df, pd.read_parquet(os.path.join(tmp, name)))
@@ -1,11 +1,15 @@
+import io
 import unittest
+from contextlib import contextmanager
 from datetime import datetime
 import os
+from unittest import mock
 
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from mya_getter.mya import mysampler
+from mya_getter.mya import mysampler, mydata
+from mya_getter.mya._mya import read_mya_table
 
 
 DIR = os.path.dirname(__file__)
@@ -25,6 +29,28 @@ class TestMysampler(unittest.TestCase):
 
         self.assertDictEqual(exp, result)
 
+    def test_to_web_params_interval(self):
+        start = datetime.strptime("2023-05-01", "%Y-%m-%d")
+        for interval, millis in (('1s', 1_000), ('15m', 900_000), ('2h', 7_200_000), ('1w', 604_800_000)):
+            query = mysampler.MySamplerQuery(start=start, interval=interval, num_samples=1, pvlist=["R1M1GMES"])
+            self.assertEqual(millis, query.to_web_params()['s'])
+
+        query = mysampler.MySamplerQuery(start=start, interval='1.5s', num_samples=1, pvlist=["R1M1GMES"])
+        with self.assertRaises(ValueError):
+            query.to_web_params()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires os.fork")
+    def test_session_reset_after_fork(self):
+        # Forked workers must not reuse the parent's pooled connections
+        parent = mysampler._session
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if mysampler._session is not parent else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(0, status)
+        self.assertIs(parent, mysampler._session)
+
     def test_mysampler_web(self):
 
         result = mysampler.mySamplerWeb(query=self.query)
@@ -38,3 +64,45 @@ class TestMysampler(unittest.TestCase):
 
         assert_frame_equal(exp, result)
 
+    def test_read_mya_table(self):
+        # Rebuild the whitespace aligned table mySampler prints from the expected frame
+        exp = pd.read_csv(f"{DIR}/test-mysampler-cli.csv", index_col=None)
+        lines = ["Date" + " " * 20 + "R1M1GMES      R1Q1GMES"]
+        for row in exp.itertuples(index=False):
+            lines.append(f"{row.Date.replace('_', ' ')}    {row.R1M1GMES:<13} {row.R1Q1GMES}")
+        result = read_mya_table(io.StringIO("\n".join(lines) + "\n"), time_sep='_')
+
+        assert_frame_equal(exp, result)
+
+    def test_read_mya_table_header_only(self):
+        result = read_mya_table(io.StringIO("Date                    R1M1GMES\n"), time_sep='_')
+
+        self.assertListEqual(['Date', 'R1M1GMES'], list(result.columns))
+        self.assertEqual(0, len(result))
+        self.assertTrue(read_mya_table(io.StringIO(""), time_sep='_').empty)
+
+        # Blank lines before the header are skipped
+        result = read_mya_table(io.StringIO("\n  \nDate PV\n2023-01-01 00:00:00 1\n"), time_sep=' ')
+        self.assertListEqual(['2023-01-01 00:00:00'], result.Date.tolist())
+        self.assertListEqual([1], result.PV.tolist())
+
+        # myData returns an empty frame rather than failing to parse dates when it prints nothing
+        @contextmanager
+        def no_output(args):
+            yield io.StringIO("")
+
+        query = mydata.MyDataQuery(begin=datetime(2023, 1, 1), end=datetime(2023, 1, 2), pvlist=["PV"])
+        with mock.patch.object(mydata, 'stream_command', no_output):
+            self.assertTrue(mydata.myData(query).empty)
+
+    def test_read_mya_table_mydata(self):
+        # myData prints fractional seconds and is parsed to datetimes afterwards
+        text = ("Date                        R1M1GMES\n"
+                "2023-05-01 00:00:00.000     0.5\n"
+                "2023-05-01 00:00:01.250     <undefined>\n")
+        result = read_mya_table(io.StringIO(text), time_sep=' ')
+        result.Date = pd.to_datetime(result.Date)
+
+        self.assertListEqual([pd.Timestamp("2023-05-01 00:00:00"), pd.Timestamp("2023-05-01 00:00:01.250")],
+                             result.Date.tolist())
+        self.assertListEqual(['0.5', '<undefined>'], result.R1M1GMES.tolist())
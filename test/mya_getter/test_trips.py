@@ -0,0 +1,123 @@
+import unittest
+import warnings
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from mya_getter import trips
+
+
+def make_states(values):
+    return pd.DataFrame({'Date': pd.date_range("2023-05-01", periods=len(values), freq='s'), 'state': values})
+
+
+class TestTrips(unittest.TestCase):
+
+    def test_collapse_overlapping_intervals(self):
+        t = pd.Timestamp("2023-05-01")
+        df = pd.DataFrame({'start': [t + pd.Timedelta(seconds=s) for s in (10, 0, 3, 20)],
+                           'end': [t + pd.Timedelta(seconds=s) for s in (12, 5, 4, 25)]})
+        exp = pd.DataFrame({'start': [t, t + pd.Timedelta(seconds=10), t + pd.Timedelta(seconds=20)],
+                            'end': [t + pd.Timedelta(seconds=s) for s in (5, 12, 25)]},
+                           index=pd.Index([0, 1, 2], name='interval_id'))
+
+        assert_frame_equal(exp, trips.collapse_overlapping_intervals(df, start='start', end='end'))
+
+    def test_collapse_overlapping_intervals_missing_end(self):
+        # The row after a missing end joins its interval, and the missing end is skipped when taking the max
+        t = pd.Timestamp("2023-05-01")
+        df = pd.DataFrame({'start': [t + pd.Timedelta(seconds=s) for s in (0, 15, 15, 20)],
+                           'end': [t + pd.Timedelta(seconds=5), pd.NaT, t + pd.Timedelta(seconds=16),
+                                   t + pd.Timedelta(seconds=25)]})
+        exp = pd.DataFrame({'start': [t + pd.Timedelta(seconds=s) for s in (0, 15, 20)],
+                            'end': [t + pd.Timedelta(seconds=s) for s in (5, 16, 25)]},
+                           index=pd.Index([0, 1, 2], name='interval_id'))
+
+        assert_frame_equal(exp, trips.collapse_overlapping_intervals(df, start='start', end='end'))
+
+    def test_interval_overlap_any(self):
+        t = pd.Timestamp("2023-05-01")
+        int1 = pd.Series([pd.Interval(t + pd.Timedelta(seconds=a), t + pd.Timedelta(seconds=b), closed='left')
+                          for a, b in ((0, 2), (5, 10), (12, 13), (20, 30))])
+        int2 = pd.Series([pd.Interval(t + pd.Timedelta(seconds=a), t + pd.Timedelta(seconds=b), closed='left')
+                          for a, b in ((25, 26), (2, 5), (9, 11))])
+
+        # Touching left-closed intervals do not overlap
+        self.assertListEqual([False, True, False, True], trips.interval_overlap_any(int1, int2))
+        self.assertListEqual([False] * 4, trips.interval_overlap_any(int1, pd.Series([], dtype=object)))
+
+    def test_remove_repeat_values(self):
+        df = make_states([0, 0, 1, 1, np.nan, np.nan, 1, 0])
+        exp = df.iloc[[0, 2, 4, 5, 6, 7]].reset_index(drop=True)
+
+        assert_frame_equal(exp, trips.remove_repeat_values(df, values_col='state'))
+
+    def test_remove_repeat_values_unsorted(self):
+        # Rows are compared in chronological order, and ties keep their original order
+        t = pd.Timestamp("2023-05-01")
+        df = pd.DataFrame({'Date': [t + pd.Timedelta(seconds=s) for s in (2, 0, 1, 1)], 'state': [1, 0, 0, 1]})
+        exp = pd.DataFrame({'Date': [t, t + pd.Timedelta(seconds=1)], 'state': [0, 1]})
+
+        assert_frame_equal(exp, trips.remove_repeat_values(df, values_col='state'))
+
+    def test_get_down_state_intervals(self):
+        df = make_states([1, 0, 0.5, 1, 1, 2, 1, np.nan, 0, 1, 0, np.nan, 1])
+        starts, ends = trips.get_down_state_intervals(df, on_state=1, off_state=0)
+
+        self.assertListEqual([df.Date[1], df.Date[5], df.Date[8]], starts)
+        self.assertListEqual([df.Date[3], df.Date[6], df.Date[9]], ends)
+
+    def test_get_down_state_intervals_repeat_off(self):
+        # A second off state while down aborts the interval, and a third starts a new one
+        df = make_states([1, 0, 0, 0, 1])
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            starts, ends = trips.get_down_state_intervals(df, on_state=1, off_state=0)
+
+        self.assertEqual(1, len(w))
+        self.assertListEqual([df.Date[3]], starts)
+        self.assertListEqual([df.Date[4]], ends)
+
+    def test_get_down_state_intervals_empty(self):
+        self.assertEqual(([], []), trips.get_down_state_intervals(make_states([])))
+
+    def test_get_rf_trip_intervals_no_trips(self):
+        # Beam is present and no RF trips are counted for the whole window
+        def fake_mydata(query):
+            value = '0' if query.pv_list == ['IPM1A01.BNSF'] else '3'
+            return pd.DataFrame({'Date': pd.date_range("2023-05-01", periods=5, freq='min'), query.pv_list[0]: value})
+
+        with mock.patch.object(trips, 'myData', side_effect=fake_mydata):
+            result = trips.get_rf_trip_intervals(begin=datetime(2023, 5, 1), end=datetime(2023, 5, 2))
+
+        self.assertEqual(0, len(result))
+        self.assertListEqual(['pv', 'start', 'end'], list(result.columns))
+
+    def test_get_combined_down_state_intervals(self):
+        # One myData query for both PVs has a row whenever either changes
+        mya_df = pd.DataFrame({'Date': pd.date_range("2023-05-01", periods=8, freq='s'),
+                               'A': ['1', '1', '1', '1', '0', '0', '1', '1'],
+                               'B': ['1', '0', '0', '1', '1', '1', '1', '0']})
+
+        # Each PV on its own only reports its state changes
+        exp_starts, exp_ends = [], []
+        for pv in ('A', 'B'):
+            pv_df = trips.remove_repeat_values(mya_df[['Date', pv]].astype({pv: float}), values_col=pv)
+            starts, ends = trips.get_down_state_intervals(pv_df)
+            exp_starts.extend(starts)
+            exp_ends.extend(ends)
+        exp = trips.collapse_overlapping_intervals(pd.DataFrame({'start': exp_starts, 'end': exp_ends}),
+                                                   start='start', end='end')
+
+        with mock.patch.object(trips, 'myData', return_value=mya_df) as fake_mydata:
+            result = trips.get_combined_down_state_intervals(pvs=['A', 'B'], begin=datetime(2023, 5, 1),
+                                                             end=datetime(2023, 5, 2))
+
+        fake_mydata.assert_called_once()
+        self.assertListEqual(['A', 'B'], fake_mydata.call_args.args[0].pv_list)
+        assert_frame_equal(exp, result)
+        self.assertListEqual([mya_df.Date[1], mya_df.Date[4]], result.start.tolist())
+        self.assertListEqual([mya_df.Date[3], mya_df.Date[6]], result.end.tolist())